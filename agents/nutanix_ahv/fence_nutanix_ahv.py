@@ -6,12 +6,24 @@
 
 import atexit
 import logging
+import random
+import socket
 import sys
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from urllib.parse import quote, urlencode
 import requests
+import urllib3
 from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
@@ -22,11 +34,40 @@ V4_VERSION = '4.0'
 MIN_TIMEOUT = 60
 PC_PORT = 9440
 POWER_STATES = {"ON": "on", "OFF": "off", "PAUSED": "off", "UNKNOWN": "unknown"}
+POWER_ACTIONS = {"on": "power-on", "off": "power-off"}
 MAX_RETRIES = 5
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+POST_RETRY_STATUSES = [429, 502, 503, 504]
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+POLL_INTERVAL_MIN = 0.5
+POLL_INTERVAL_MAX = 5
+POLL_BACKOFF = 1.7
+POLL_JITTER = 0.1
+MAX_WORKERS = 8
+PAGE_SIZE = 100
+ETAG_CACHE_SIZE = 16
+KEEPALIVE_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+# The keepalive timers are not available on every platform
+KEEPALIVE_OPTIONS += [(socket.IPPROTO_TCP, getattr(socket, name), value)
+                      for name, value in (("TCP_KEEPIDLE", 60),
+                                          ("TCP_KEEPINTVL", 20),
+                                          ("TCP_KEEPCNT", 3))
+                      if hasattr(socket, name)]
+BASE_HEADERS = {'Accept': 'application/json',
+                'Content-Type': 'application/json'}
 
 
 class NutanixClientException(Exception):
-    pass
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+    def __str__(self):
+        if self.response is None:
+            return self.args[0]
+
+        return f"{self.args[0]}: {self.response}"
 
 
 class AHVFenceAgentException(Exception):
@@ -37,58 +78,153 @@ class TaskTimedOutException(Exception):
     pass
 
 
+class RequestTimedOutException(TaskTimedOutException):
+    pass
+
+
 class InvalidArgsException(Exception):
     pass
 
 
+class PowerActionRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # A 500 on a POST is usually Prism rejecting the action itself,
+        # replaying it would only delay the failure
+        if method.upper() == 'POST' and status_code not in POST_RETRY_STATUSES:
+            return False
+
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        # Keep the idle Prism Central connection from being dropped by
+        # firewalls or NAT between calls
+        kwargs['socket_options'] = (HTTPConnection.default_socket_options +
+                                    KEEPALIVE_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+
+
+def is_timeout_error(err):
+    if isinstance(err, requests.exceptions.Timeout):
+        return True
+
+    # Once the retries are used up a read timeout surfaces as a
+    # ConnectionError wrapping urllib3's MaxRetryError. A refused
+    # connection (NewConnectionError) subclasses ConnectTimeoutError.
+    reason = getattr(err.args[0], 'reason', None) if err.args else None
+
+    return (isinstance(reason, urllib3.exceptions.TimeoutError) and
+            not isinstance(reason, urllib3.exceptions.NewConnectionError))
+
+
 class NutanixClient:
-    def __init__(self, username, password, disable_warnings=False):
+    def __init__(self, username, password, verify=True,
+                 disable_warnings=False):
         self.username = username
         self.password = password
-        self.valid_status_codes = [200, 202]
+        self.verify = verify
+        self.valid_status_codes = frozenset([200, 202])
         self.disable_warnings = disable_warnings
+        self.etag_cache = {}
         self.session = requests.Session()
         self.session.auth = (self.username, self.password)
+        self.session.verify = self.verify
+        self.session.headers.update(BASE_HEADERS)
+
+        # POSTs carry an Ntnx-Request-Id which Prism Central uses to
+        # deduplicate them, so replaying a power action is safe. A single
+        # read retry covers a dropped keep-alive connection, a hung call
+        # still ends after two READ_TIMEOUTs.
+        # The last response is returned once retries run out, so its
+        # error body is still logged and attached to the exception.
+        retry_strategy = PowerActionRetry(total=MAX_RETRIES,
+                                          read=1,
+                                          backoff_factor=0.5,
+                                          status_forcelist=RETRY_STATUSES,
+                                          allowed_methods=["GET", "POST"],
+                                          raise_on_status=False,
+                                          respect_retry_after_header=True)
+
+        # All requests go to a single Prism Central host, size the pool for
+        # the VM list pages _get_all_vms fetches in parallel.
+        adapter = KeepAliveHTTPAdapter(pool_connections=1,
+                                       pool_maxsize=MAX_WORKERS,
+                                       max_retries=retry_strategy)
+        self.session.mount("https://", adapter)
 
-        retry_strategy = Retry(total=MAX_RETRIES,
-                               backoff_factor=1,
-                               status_forcelist=[429, 500, 503])
-
-        self.session.mount("https://", HTTPAdapter(max_retries=retry_strategy))
+        if self.disable_warnings:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
     def request(self, url, method='GET', headers=None, **kwargs):
+        response = None
+        valid_status_codes = self.valid_status_codes
 
-        if self.disable_warnings:
-            requests.packages.urllib3.disable_warnings()
-
-        if headers:
-            self.session.headers.update(headers)
+        # A 304 is only meaningful as the answer to our If-None-Match
+        if headers and 'If-None-Match' in headers:
+            valid_status_codes = valid_status_codes | {304}
 
-        response = None
+        # Never let a hung connection outlive the fence action
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+        # Passed per call, a session level verify loses to REQUESTS_CA_BUNDLE
+        kwargs.setdefault('verify', self.verify)
 
         try:
             logging.debug("Sending %s request to %s", method, url)
-            response = self.session.request(method, url, **kwargs)
-            response.raise_for_status()
+            response = self.session.request(method, url, headers=headers,
+                                            **kwargs)
         except requests.exceptions.SSLError as err:
             logging.error("Secure connection failed, verify SSL certificate")
             logging.error("Error message: %s", err)
             raise NutanixClientException("Secure connection failed") from err
         except requests.exceptions.RequestException as err:
-            logging.error("API call failed: %s", response.text)
+            if is_timeout_error(err):
+                logging.error("API call to %s timed out", url)
+                logging.error("Error message: %s", err)
+                raise RequestTimedOutException("API call timed out") from err
+
+            # No response exists when the request itself failed
+            logging.error("API call to %s failed", url)
             logging.error("Error message: %s", err)
             raise NutanixClientException(f"API call failed: {err}") from err
         except Exception as err:
-            logging.error("API call failed: %s", response.text)
+            logging.error("API call to %s failed", url)
             logging.error("Unknown error %s", err)
             raise NutanixClientException(f"API call failed: {err}") from err
 
-        if response.status_code not in self.valid_status_codes:
+        if response.status_code not in valid_status_codes:
             logging.error("API call returned status code %s", response.status_code)
-            raise NutanixClientException(f"API call failed: {response}")
+            logging.error("API call failed: %s", response.text)
+            raise NutanixClientException("API call failed", response)
 
         return response
 
+    def revalidate(self, url):
+        # Polled resources are fetched again only when they changed,
+        # Prism Central answers with 304 otherwise.
+        headers = None
+        cached = self.etag_cache.pop(url, None)
+
+        if cached:
+            headers = {'If-None-Match': cached[1]}
+
+        response = self.request(url=url, method='GET', headers=headers)
+
+        if response.status_code == 304:
+            logging.debug("Resource %s not modified", url)
+            content, etag = cached
+        else:
+            content, etag = response.content, response.headers.get('Etag')
+
+        if etag:
+            # Entries are reinserted on use, evict the least recently used
+            self.etag_cache[url] = (content, etag)
+
+            while len(self.etag_cache) > ETAG_CACHE_SIZE:
+                del self.etag_cache[next(iter(self.etag_cache))]
+
+        return content, etag
+
 
 class NutanixV4Client(NutanixClient):
     def __init__(self, host=None, username=None, password=None,
@@ -96,52 +232,89 @@ class NutanixV4Client(NutanixClient):
         self.host = host
         self.username = username
         self.password = password
-        self.verify = verify
         self.base_url = f"https://{self.host}:{PC_PORT}/api"
         self.vm_url = f"{self.base_url}/vmm/v{V4_VERSION}/ahv/config/vms"
         self.task_url = f"{self.base_url}/prism/v{V4_VERSION}/config/tasks"
-        super().__init__(username, password, disable_warnings)
-
-    def _get_headers(self, vm_uuid=None):
-        resp = None
-        headers = {'Accept':'application/json',
-                   'Content-Type': 'application/json'}
-
-        if vm_uuid:
+        self.vm_item_url = self.vm_url + "/{}"
+        self.vm_action_url = self.vm_url + "/{}/$actions/{}"
+        self.task_item_url = self.task_url + "/{}"
+        self.vm_uuid_cache = {}
+        self.vm_etags = {}
+        super().__init__(username, password, verify, disable_warnings)
+
+    def _get_headers(self, vm_uuid):
+        # An etag is only good for one update, the VM changes after it
+        etag_str = self.vm_etags.pop(vm_uuid, None)
+
+        if not etag_str:
             try:
-                resp = self._get_vm(vm_uuid)
+                self._get_vm(vm_uuid)
             except AHVFenceAgentException as err:
                 logging.error("Unable to retrieve etag")
                 raise AHVFenceAgentException from err
 
-            etag_str = resp.headers['Etag']
-            request_id = str(uuid.uuid1())
-            headers['If-Match'] = etag_str
-            headers['Ntnx-Request-Id'] = request_id
+            etag_str = self.vm_etags.pop(vm_uuid, None)
+
+        if not etag_str:
+            logging.error("No etag returned for VM %s", vm_uuid)
+            raise AHVFenceAgentException(f"Unable to get etag of VM {vm_uuid}")
+
+        request_id = str(uuid.uuid4())
+        headers = {'If-Match': etag_str, 'Ntnx-Request-Id': request_id}
 
         return headers
 
-    def _get_all_vms(self, filter_str=None, limit=None):
-        vm_url = self.vm_url
+    def _get_all_vms(self, filter_str=None, limit=None, select=None):
+        if limit:
+            return self._get_vm_page(filter_str, limit, select)
+
+        # Without a limit the API returns only its first page, fetch the
+        # first one to learn the total and the remaining pages in parallel.
+        vms = self._get_vm_page(filter_str, PAGE_SIZE, select, page=0)
+        total = vms.get('metadata', {}).get('totalAvailableResults', 0)
+        pages = range(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+
+        if not pages:
+            return vms
 
-        if filter_str and limit:
-            vm_url = f"{vm_url}?$filter={filter_str}&$limit={limit}"
-        elif filter_str and not limit:
-            vm_url = f"{vm_url}?$filter={filter_str}"
-        elif limit and not filter_str:
-            vm_url = f"{vm_url}?$limit={limit}"
+        def get_page(page):
+            return self._get_vm_page(filter_str, PAGE_SIZE, select, page)
+
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS,
+                                                len(pages))) as executor:
+            for page_vms in executor.map(get_page, pages):
+                vms['data'].extend(page_vms.get('data', []))
+
+        return vms
+
+    def _get_vm_page(self, filter_str=None, limit=None, select=None,
+                     page=None):
+        vm_url = self.vm_url
+        params = {}
+
+        if filter_str:
+            params['$filter'] = filter_str
+        if page:
+            params['$page'] = page
+        if limit:
+            params['$limit'] = limit
+        if select:
+            # Only ask for the fields we use, full VM configs are large
+            params['$select'] = select
+
+        if params:
+            query = urlencode(params, safe="$',()", quote_via=quote)
+            vm_url = f"{vm_url}?{query}"
 
         logging.debug("Getting info for all VMs, %s", vm_url)
-        header_str = self._get_headers()
 
         try:
-            resp = self.request(url=vm_url, method='GET',
-                                headers=header_str, verify=self.verify)
+            resp = self.request(url=vm_url, method='GET')
         except NutanixClientException as err:
             logging.error("Unable to retrieve VM info")
             raise AHVFenceAgentException from err
 
-        vms = resp.json()
+        vms = json_loads(resp.content)
         return vms
 
     def _get_vm_uuid(self, vm_name):
@@ -152,9 +325,15 @@ class NutanixV4Client(NutanixClient):
             logging.error("VM name was not provided")
             raise AHVFenceAgentException("VM name not provided")
 
+        if vm_name in self.vm_uuid_cache:
+            return self.vm_uuid_cache[vm_name]
+
+        # Quotes inside OData string literals are escaped by doubling them
+        filter_str = "name eq '{}'".format(vm_name.replace("'", "''"))
+
         try:
-            filter_str = f"name eq '{vm_name}'"
-            resp = self._get_all_vms(filter_str=filter_str)
+            resp = self._get_all_vms(filter_str=filter_str, limit=1,
+                                     select="name,extId")
         except AHVFenceAgentException as err:
             logging.error("Failed to get VM info for VM %s", vm_name)
             raise AHVFenceAgentException from err
@@ -168,86 +347,72 @@ class NutanixV4Client(NutanixClient):
             logging.error("Failed to retrieve VM UUID for VM %s", vm_name)
             raise AHVFenceAgentException(err)
 
-        for vm in resp['data']:
-            if vm['name'] == vm_name:
-                vm_uuid = vm['extId']
-                break
+        # The server applied the exact name match, take the single result
+        if resp['data'] and resp['data'][0]['name'] == vm_name:
+            vm_uuid = resp['data'][0]['extId']
+
+        if vm_uuid:
+            self.vm_uuid_cache[vm_name] = vm_uuid
 
         return vm_uuid
 
+    def _forget_vm_uuid(self, vm_uuid):
+        # The VM may have been deleted or recreated under the same name
+        stale = [name for name, ext_id in self.vm_uuid_cache.items()
+                 if ext_id == vm_uuid]
+
+        for vm_name in stale:
+            del self.vm_uuid_cache[vm_name]
+
     def _get_vm(self, vm_uuid):
         if not vm_uuid:
             logging.error("VM UUID was not provided")
             raise AHVFenceAgentException("VM UUID not provided")
 
-        vm_url = self.vm_url + f"/{vm_uuid}"
+        vm_url = self.vm_item_url.format(vm_uuid)
         logging.debug("Getting config information for VM, %s", vm_uuid)
 
         try:
-            header_str = self._get_headers()
-            resp = self.request(url=vm_url, method='GET',
-                                headers=header_str, verify=self.verify)
+            vm, etag = self.revalidate(vm_url)
         except NutanixClientException as err:
             logging.error("Failed to retrieve VM details "
                           "for VM UUID: %s", vm_uuid)
-            raise AHVFenceAgentException from err
-        except AHVFenceAgentException as err:
-            logging.error("Failed to retrieve etag from headers")
+            self._forget_vm_uuid(vm_uuid)
             raise AHVFenceAgentException from err
 
-        return resp
+        self.vm_etags[vm_uuid] = etag
 
-    def _power_on_off_vm(self, power_state=None, vm_uuid=None):
-        resp = None
-        vm_url = None
+        return vm
 
-        if not vm_uuid:
-            logging.error("VM UUID was not provided")
-            raise AHVFenceAgentException("VM UUID not provided")
-        if not power_state:
-            logging.error("Requested VM power state is None")
-            raise InvalidArgsException
-
-        power_state = power_state.lower()
-
-        if power_state == 'on':
-            vm_url = self.vm_url + f"/{vm_uuid}/$actions/power-on"
-            logging.debug("Sending request to power on VM, %s", vm_uuid)
-        elif power_state == 'off':
-            vm_url = self.vm_url + f"/{vm_uuid}/$actions/power-off"
-            logging.debug("Sending request to power off VM, %s", vm_uuid)
-        else:
-            logging.error("Invalid power state specified: %s", power_state)
-            raise InvalidArgsException
+    def _post_vm_action(self, vm_url, vm_uuid):
+        headers_str = self._get_headers(vm_uuid)
 
         try:
-            headers_str = self._get_headers(vm_uuid)
-            resp = self.request(url=vm_url, method='POST',
-                                headers=headers_str, verify=self.verify)
+            return self.request(url=vm_url, method='POST',
+                                headers=headers_str)
         except NutanixClientException as err:
-            logging.error("Failed to power off VM %s", vm_uuid)
-            raise AHVFenceAgentException from err
-        except AHVFenceAgentException as err:
-            logging.error("Failed to retrieve etag from headers")
-            raise AHVFenceAgentException from err
+            if err.response is None or err.response.status_code != 412:
+                raise
 
-        return resp
+        # The etag we held was stale, refetch the VM and retry once
+        logging.debug("Etag of VM %s is outdated, retrying", vm_uuid)
+        headers_str = self._get_headers(vm_uuid)
+
+        return self.request(url=vm_url, method='POST', headers=headers_str)
 
-    def _power_cycle_vm(self, vm_uuid):
+    def _power_action(self, vm_uuid, action):
         if not vm_uuid:
             logging.error("VM UUID was not provided")
             raise AHVFenceAgentException("VM UUID not provided")
 
         resp = None
-        vm_url = self.vm_url + f"/{vm_uuid}/$actions/power-cycle"
-        logging.debug("Sending request to power cycle VM, %s", vm_uuid)
+        vm_url = self.vm_action_url.format(vm_uuid, action)
+        logging.debug("Sending %s request for VM, %s", action, vm_uuid)
 
         try:
-            header_str = self._get_headers(vm_uuid)
-            resp = self.request(url=vm_url, method='POST',
-                                headers=header_str, verify=self.verify)
+            resp = self._post_vm_action(vm_url, vm_uuid)
         except NutanixClientException as err:
-            logging.error("Failed to power on VM %s", vm_uuid)
+            logging.error("Failed to %s VM %s", action, vm_uuid)
             raise AHVFenceAgentException from err
         except AHVFenceAgentException as err:
             logging.error("Failed to retrieve etag from headers")
@@ -255,15 +420,21 @@ class NutanixV4Client(NutanixClient):
 
         return resp
 
+    def _get_task_uuid(self, resp):
+        try:
+            return json_loads(resp.content)['data']['extId']
+        except (ValueError, KeyError, TypeError) as err:
+            logging.error("Unable to retrieve task UUID from response")
+            raise AHVFenceAgentException from err
+
     def _wait_for_task(self, task_uuid, timeout=None):
         if not task_uuid:
             logging.error("Task UUID was not provided")
             raise AHVFenceAgentException("Task UUID not provided")
 
-        task_url = f"{self.task_url}/{task_uuid}"
-        header_str = self._get_headers()
-        task_resp = None
-        interval = 5
+        task_url = self.task_item_url.format(task_uuid)
+        task_etag = None
+        interval = POLL_INTERVAL_MIN
         task_status = None
 
         if not timeout:
@@ -274,20 +445,33 @@ class NutanixV4Client(NutanixClient):
             except ValueError:
                 timeout = MIN_TIMEOUT
 
+        deadline = time.monotonic() + timeout
+
+        # Most power tasks finish within a couple of seconds, start polling
+        # early and back off for the slow ones.
         while task_status != 'SUCCEEDED':
-            if timeout <= 0:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
                 raise TaskTimedOutException(f"Task timed out: {task_uuid}")
 
-            time.sleep(interval)
-            timeout = timeout - interval
+            # Do not oversleep the deadline, poll one last time at it
+            time.sleep(min(interval + random.uniform(0, interval * POLL_JITTER),
+                           remaining))
+            interval = min(interval * POLL_BACKOFF, POLL_INTERVAL_MAX)
 
             try:
-                task_resp = self.request(url=task_url, method='GET',
-                                         headers=header_str, verify=self.verify)
-                task_status = task_resp.json()['data']['status']
+                task, etag = self.revalidate(task_url)
+
+                # An unchanged task still has the status we last saw
+                if etag is None or etag != task_etag:
+                    task_status = json_loads(task)['data']['status']
+                    task_etag = etag
             except NutanixClientException as err:
                 logging.error("Unable to retrieve task status")
                 raise AHVFenceAgentException from err
+            except RequestTimedOutException:
+                raise
             except Exception as err:
                 logging.error("Unknown error")
                 raise AHVFenceAgentException from err
@@ -295,12 +479,24 @@ class NutanixV4Client(NutanixClient):
             if task_status == 'FAILED':
                 raise AHVFenceAgentException(f"Task failed, task uuid: {task_uuid}")
 
+        # A finished task is not polled again
+        self.etag_cache.pop(task_url, None)
+
+    def ping(self):
+        # Cheapest authenticated call, proves both the route and credentials
+        try:
+            self._get_all_vms(limit=1, select="extId")
+        except AHVFenceAgentException as err:
+            logging.error("Unable to reach Prism Central at %s", self.host)
+            raise AHVFenceAgentException from err
+
     def list_vms(self, filter_str=None, limit=None):
         vms = None
         vm_list = {}
 
         try:
-            vms = self._get_all_vms(filter_str, limit)
+            vms = self._get_all_vms(filter_str, limit,
+                                    select="name,extId,powerState")
         except NutanixClientException as err:
             logging.error("Failed to retrieve VM list")
             raise AHVFenceAgentException from err
@@ -313,16 +509,15 @@ class NutanixV4Client(NutanixClient):
             err = "Got invalid or empty VM list"
             logging.debug(err)
         else:
-            for vm in vms['data']:
-                vm_name = vm['name']
-                ext_id = vm['extId']
-                power_state = vm['powerState']
-                vm_list[vm_name] = (ext_id, power_state)
+            vm_fields = itemgetter('name', 'extId', 'powerState')
+            vm_list = {vm_name: (ext_id, power_state)
+                       for vm_name, ext_id, power_state
+                       in map(vm_fields, vms['data'])}
 
         return vm_list
 
     def get_power_state(self, vm_name=None, vm_uuid=None):
-        resp = None
+        vm = None
         power_state = None
 
         if not vm_name and not vm_uuid:
@@ -337,13 +532,13 @@ class NutanixV4Client(NutanixClient):
                 raise AHVFenceAgentException from err
 
         try:
-            resp = self._get_vm(vm_uuid)
+            vm = self._get_vm(vm_uuid)
         except AHVFenceAgentException as err:
             logging.error("Unable to retrieve power state of VM %s", vm_uuid)
             raise AHVFenceAgentException from err
 
         try:
-            power_state = resp.json()['data']['powerState']
+            power_state = json_loads(vm)['data']['powerState']
         except AHVFenceAgentException as err:
             logging.error("Failed to retrieve power state of VM %s", vm_uuid)
             raise AHVFenceAgentException from err
@@ -354,7 +549,7 @@ class NutanixV4Client(NutanixClient):
                         power_state='off', timeout=None):
         resp = None
         current_power_state = None
-        power_state = power_state.lower()
+        power_state = power_state.strip().lower()
 
         if not timeout:
             timeout = MIN_TIMEOUT
@@ -363,6 +558,10 @@ class NutanixV4Client(NutanixClient):
             logging.error("Require at least one of VM name or VM UUID")
             raise InvalidArgsException("No arguments provided")
 
+        if power_state not in POWER_ACTIONS:
+            logging.error("Invalid power state specified: %s", power_state)
+            raise InvalidArgsException(f"Invalid power state: {power_state}")
+
         if not vm_uuid:
             vm_uuid = self._get_vm_uuid(vm_name)
 
@@ -371,30 +570,27 @@ class NutanixV4Client(NutanixClient):
         except AHVFenceAgentException as err:
             raise AHVFenceAgentException from err
 
-        if current_power_state.lower() == power_state.lower():
-            logging.debug("VM already powered %s", power_state.lower())
+        if current_power_state == power_state:
+            logging.debug("VM already powered %s", power_state)
             return
 
-        if power_state.lower() == 'on':
-            resp = self._power_on_off_vm(power_state, vm_uuid)
-        elif power_state.lower() == 'off':
-            resp = self._power_on_off_vm(power_state, vm_uuid)
+        resp = self._power_action(vm_uuid, POWER_ACTIONS[power_state])
 
-        task_id = resp.json()['data']['extId']
+        task_id = self._get_task_uuid(resp)
 
         try:
             self._wait_for_task(task_id, timeout)
         except AHVFenceAgentException as err:
-            logging.error("Failed to power %s VM", power_state.lower())
-            logging.error("VM power %s task failed", power_state.lower())
+            logging.error("Failed to power %s VM", power_state)
+            logging.error("VM power %s task failed", power_state)
             raise AHVFenceAgentException from err
         except TaskTimedOutException as err:
             logging.error("Timed out powering %s VM %s",
-                          power_state.lower(), vm_uuid)
+                          power_state, vm_uuid)
             raise TaskTimedOutException from err
 
         logging.debug("Powered %s VM, %s successfully",
-                     power_state.lower(), vm_uuid)
+                     power_state, vm_uuid)
 
     def power_cycle_vm(self, vm_name=None, vm_uuid=None, timeout=None):
         resp = None
@@ -410,8 +606,8 @@ class NutanixV4Client(NutanixClient):
         if not vm_uuid:
             vm_uuid = self._get_vm_uuid(vm_name)
 
-        resp = self._power_cycle_vm(vm_uuid)
-        task_id = resp.json()['data']['extId']
+        resp = self._power_action(vm_uuid, "power-cycle")
+        task_id = self._get_task_uuid(resp)
 
         try:
             self._wait_for_task(task_id, timeout)
@@ -442,11 +638,15 @@ def connect(options):
                              verify_ssl, disable_warnings)
 
     try:
-        client.list_vms(limit=1)
+        client.ping()
     except AHVFenceAgentException as err:
         logging.error("Connection to Prism Central Failed")
         logging.error(err)
         fail(EC_LOGIN_DENIED)
+    except TaskTimedOutException as err:
+        logging.error("Connection to Prism Central timed out")
+        logging.error(err)
+        fail(EC_TIMED_OUT)
 
     return client
 
@@ -462,6 +662,9 @@ def get_list(client, options):
         logging.error("Failed to list VMs")
         logging.error(err)
         fail(EC_GENERIC_ERROR)
+    except TaskTimedOutException as err:
+        logging.error(err)
+        fail(EC_TIMED_OUT)
 
     return vm_list
 
@@ -480,6 +683,9 @@ def get_power_status(client, options):
         power_state = client.get_power_state(vm_name=name, vm_uuid=vmid)
     except AHVFenceAgentException:
         fail(EC_GENERIC_ERROR)
+    except TaskTimedOutException as err:
+        logging.error(err)
+        fail(EC_TIMED_OUT)
     except InvalidArgsException:
         fail(EC_BAD_ARGS)
 